@@ -0,0 +1,86 @@
+from PIL import Image
+import os
+import struct
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir, "src"))
+
+from smartPotato.encoderPool import EncoderPool
+
+"""
+Execute this to check EncoderPool against fakeNvcompress.py, a stand-in for nvcompress.
+Covers single and batched calls, non-zero exits and missing outputs.
+Usage: checkEncoderPool.py
+"""
+
+fakeNvcompress = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fakeNvcompress.py"
+)
+image = Image.new("RGBA", (64, 32))
+
+
+def ddsSize(path: str) -> tuple[int, int]:
+    with open(path, "rb") as fp:
+        header = fp.read(20)
+    height, width = struct.unpack("<II", header[12:20])
+    return width, height
+
+
+def encode(outdir: str, names: list[str], batchSize: int) -> dict[str, str]:
+    """
+    Encodes image to each of names in outdir.
+
+    Returns:
+        The failure messages by file name.
+    """
+    pool = EncoderPool(fakeNvcompress, 2, batchSize)
+    for name in names:
+        pool.submit(image, "-bc3", os.path.join(outdir, name))
+    failures = pool.wait()
+    pool.close()
+    return {os.path.basename(f.path): f.message for f in failures}
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        print(f"FAILED: {message}")
+        sys.exit(1)
+    print(f"ok: {message}")
+
+
+with tempfile.TemporaryDirectory() as outdir:
+    for batchSize in (1, 3):
+        names = [f"a{batchSize}.dds", f"b{batchSize}.dds", f"c{batchSize}.dds"]
+        failures = encode(outdir, names, batchSize)
+        check(
+            len(failures) == 0
+            and all(ddsSize(os.path.join(outdir, name)) == (64, 32) for name in names),
+            f"batch size {batchSize} encodes every file",
+        )
+
+    failures = encode(outdir, ["fail.dds"], 1)
+    check(
+        list(failures.keys()) == ["fail.dds"]
+        and "exited with 1" in failures["fail.dds"],
+        "a non-zero exit is reported for its file",
+    )
+
+    failures = encode(outdir, ["ok1.dds", "fail2.dds", "ok3.dds"], 3)
+    check(
+        list(failures.keys()) == ["fail2.dds"]
+        and os.path.isfile(os.path.join(outdir, "ok1.dds"))
+        and os.path.isfile(os.path.join(outdir, "ok3.dds")),
+        "a non-zero exit in a batch is only reported for the files it didn't produce",
+    )
+
+    for batchSize in (1, 2):
+        missingName = f"missing{batchSize}.dds"
+        failures = encode(outdir, [missingName, f"d{batchSize}.dds"], batchSize)
+        check(
+            list(failures.keys()) == [missingName]
+            and "didn't produce a file" in failures[missingName],
+            f"a missing output is reported with batch size {batchSize}",
+        )
+
+print("All encoder pool checks passed")
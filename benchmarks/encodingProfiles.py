@@ -0,0 +1,44 @@
+from PIL import Image
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir, "src"))
+
+from smartPotato.output import encodingProfiles, saveOptions
+
+"""
+Execute this to compare encode time and file size of the output encoding profiles.
+Usage: encodingProfiles.py <texture directory>
+"""
+
+directory = sys.argv[1]
+registeredExtensions = Image.registered_extensions()
+
+images: list[tuple[str, Image.Image, str]] = []
+for root, _, files in os.walk(directory):
+    for filename in files:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in registeredExtensions and extension != ".dds":
+            filepath = os.path.join(root, filename)
+            image = Image.open(filepath)
+            image.load()
+            images.append((filepath, image, registeredExtensions[extension]))
+
+print(f"Loaded {len(images)} images")
+
+for profile in encodingProfiles.keys():
+    totalTime = 0.0
+    totalSize = 0
+    for filepath, image, imageFormat in images:
+        buffer = io.BytesIO()
+        s_time = time.time()
+        image.save(buffer, format=imageFormat, **saveOptions(profile, imageFormat))
+        e_time = time.time()
+        totalTime += e_time - s_time
+        totalSize += buffer.tell()
+
+    print(
+        f"{profile:>8}: encoding took {totalTime:.2f} seconds, {totalSize/1024/1024:.2f} MiB total"
+    )
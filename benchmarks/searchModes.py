@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir, "src"))
+
+from smartPotato.image import ImageHandler
+from smartPotato.main import listSupportedImages
+
+"""
+Execute this to compare the 'descent' and 'direct' search modes of reduce.
+Usage: searchModes.py <texture directory> [reduceby] [mindimension]
+"""
+
+directory = sys.argv[1]
+reduceBy = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+minDimension = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+modes = ["descent", "direct"]
+totalTimes = {mode: 0.0 for mode in modes}
+differentCount = 0
+comparedCount = 0
+files = listSupportedImages(directory)
+
+for f in files:
+    # load separately so no embeddings are shared between the modes
+    # DDS files need the texture tools, which this doesn't set up
+    try:
+        handlers = {mode: ImageHandler(f, None) for mode in modes}
+    except Exception as e:
+        print(f"Skipping {f}: {e}")
+        continue
+    comparedCount += 1
+
+    results = {}
+    for mode in modes:
+        handler = handlers[mode]
+        s_time = time.time()
+        newtex, conversionData = handler.reduce(
+            minDimension, minDimension, 1.0 - reduceBy, mode
+        )
+        e_time = time.time()
+        totalTimes[mode] += e_time - s_time
+        results[mode] = (conversionData, e_time - s_time)
+
+    print(f"{f}:")
+    for mode in modes:
+        data, t = results[mode]
+        print(
+            f"  {mode:>8}: {data.width}x{data.height} ~ {data.quality*100.0:5.2f}% in {t:.2f}s"
+        )
+
+    descentData = results["descent"][0]
+    directData = results["direct"][0]
+    if (descentData.width, descentData.height) != (directData.width, directData.height):
+        differentCount += 1
+        print("  Resolutions differ!")
+
+print(f"Resolutions differ for {differentCount}/{comparedCount} textures")
+for mode in modes:
+    print(f"Total {mode} time: {totalTimes[mode]:.2f} seconds.")
@@ -0,0 +1,153 @@
+from os import path as pt
+import struct
+import sys
+import zipfile
+
+from .image import isSupportedImage
+
+# Extensions we write as zip archives when given as the output
+archive_extensions = {".zip", ".pak"}
+
+# Image formats that are compressed already, deflating them again
+# costs time for next to no savings
+stored_extensions = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+
+# ZipFile internals copyMemberRaw writes through
+_rawCopyAttributes = (
+    "fp",
+    "_lock",
+    "start_dir",
+    "filelist",
+    "NameToInfo",
+    "_didModify",
+)
+
+# Size of the fixed part of a zip local file header
+_localHeaderSize = 30
+_localHeaderSignature = b"PK\x03\x04"
+
+
+def isArchive(file_path):
+    # Existing files are checked by content, new ones by extension
+    if pt.isfile(file_path):
+        return zipfile.is_zipfile(file_path)
+    return pt.splitext(file_path)[1].lower() in archive_extensions
+
+
+def isSafeMemberName(name: str):
+    # Like ZipFile.extract, don't allow absolute paths, drive letters or '..',
+    # so a member can't be written outside of the output folder
+    if name.startswith(("/", "\\")) or pt.splitdrive(name)[0]:
+        return False
+    parts = name.replace("\\", "/").split("/")
+    return ".." not in parts and ":" not in parts[0]
+
+
+def listSupportedMembers(archive: zipfile.ZipFile):
+    members = []
+    for info in archive.infolist():
+        if info.is_dir() or not isSupportedImage(info.filename):
+            continue
+        if not isSafeMemberName(info.filename):
+            print(f"Skipping unsafe archive member '{info.filename}'", file=sys.stderr)
+            continue
+        members.append(info.filename)
+    return members
+
+
+def memberCompressType(name: str, sourceInfo: zipfile.ZipInfo | None = None) -> int:
+    """
+    Returns the compression to write a replaced archive member with:
+    stored for already compressed image formats, otherwise the same as
+    the source member if there is one, or deflated.
+    """
+    if pt.splitext(name)[1].lower() in stored_extensions:
+        return zipfile.ZIP_STORED
+    if sourceInfo is not None:
+        return sourceInfo.compress_type
+    return zipfile.ZIP_DEFLATED
+
+
+def _stripZip64Extra(extra: bytes) -> bytes:
+    """
+    Removes zip64 fields (id 0x0001) from a zip extra field,
+    they get rewritten from the actual sizes and offsets.
+    """
+    out = b""
+    i = 0
+    while i + 4 <= len(extra):
+        fieldId, fieldLength = struct.unpack("<HH", extra[i : i + 4])
+        if fieldId != 0x0001:
+            out += extra[i : i + 4 + fieldLength]
+        i += 4 + fieldLength
+    return out
+
+
+def copyMemberRaw(src: zipfile.ZipFile, info: zipfile.ZipInfo, dst: zipfile.ZipFile):
+    """
+    Copies a member from src to dst without decompressing and recompressing it.
+    The member's attributes and extra fields (timestamps, unicode paths...) are kept.
+
+    zipfile has no public API for this, so it relies on ZipFile internals
+    (fp, _lock, start_dir, filelist, NameToInfo, _didModify
+    and ZipInfo.FileHeader), which are the same in CPython 3.8 to 3.13.
+    Checked with CPython 3.11.
+    If any of them is missing, the member is decompressed and written with
+    writestr instead.
+    """
+    if not (
+        all(hasattr(dst, a) for a in _rawCopyAttributes)
+        and hasattr(zipfile.ZipInfo, "FileHeader")
+    ):
+        newInfo = zipfile.ZipInfo(info.filename, info.date_time)
+        newInfo.compress_type = info.compress_type
+        newInfo.comment = info.comment
+        newInfo.create_system = info.create_system
+        newInfo.external_attr = info.external_attr
+        newInfo.extra = _stripZip64Extra(info.extra)
+        dst.writestr(newInfo, src.read(info))
+        return
+
+    # find the raw data past the local header
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(_localHeaderSize)
+    assert (
+        header[0:4] == _localHeaderSignature
+    ), f"Bad local header for archive member '{info.filename}'"
+    nameLength, extraLength = struct.unpack("<HH", header[26:30])
+    src.fp.seek(nameLength, 1)
+    localExtra = src.fp.read(extraLength)
+    rawData = src.fp.read(info.compress_size)
+
+    # the sizes and CRC are known, so they go in the local header
+    # instead of a trailing data descriptor
+    newInfo = zipfile.ZipInfo(info.filename, info.date_time)
+    newInfo.compress_type = info.compress_type
+    newInfo.comment = info.comment
+    newInfo.create_system = info.create_system
+    newInfo.create_version = info.create_version
+    newInfo.extract_version = info.extract_version
+    newInfo.internal_attr = info.internal_attr
+    newInfo.external_attr = info.external_attr
+    newInfo.flag_bits = info.flag_bits & ~0x08
+    newInfo.CRC = info.CRC
+    newInfo.compress_size = info.compress_size
+    newInfo.file_size = info.file_size
+
+    zip64 = (
+        info.file_size > zipfile.ZIP64_LIMIT
+        or info.compress_size > zipfile.ZIP64_LIMIT
+    )
+
+    with dst._lock:
+        dst.fp.seek(dst.start_dir)
+        newInfo.header_offset = dst.fp.tell()
+        # the local header gets the local extra, the central directory the central one
+        newInfo.extra = _stripZip64Extra(localExtra)
+        dst.fp.write(newInfo.FileHeader(zip64))
+        newInfo.extra = _stripZip64Extra(info.extra)
+        dst.fp.write(rawData)
+        dst.filelist.append(newInfo)
+        dst.NameToInfo[newInfo.filename] = newInfo
+        dst.start_dir = dst.fp.tell()
+        dst._didModify = True
@@ -0,0 +1,179 @@
+import time
+
+# Both the savings and the cost of a texture are estimated as if the search
+# accepts this many halvings, the first one is where most of the savings are
+expectedAcceptedLevels = 1
+
+
+def maxLevels(width: int, height: int, minwidth: int, minheight: int) -> int:
+    """
+    Returns how many times a texture can be halved without reaching the minimal size.
+    """
+    levels = 0
+    while (width >> (levels + 1)) > minwidth and (height >> (levels + 1)) > minheight:
+        levels += 1
+    return levels
+
+
+def workRounds(
+    width: int,
+    height: int,
+    minwidth: int,
+    minheight: int,
+    searchMode: str = "descent",
+    acceptedLevels: int = expectedAcceptedLevels,
+) -> int:
+    """
+    Estimates the amount of work for reducing a texture, in rounds that each cost
+    about as much as scoring one candidate set at the original resolution.
+    That's the candidate sets the search scores when it accepts acceptedLevels
+    halvings, plus one round for loading and saving.
+    """
+    levels = maxLevels(width, height, minwidth, minheight)
+    accepted = min(acceptedLevels, levels)
+
+    rounds = 0
+    if searchMode == "direct":
+        # the same binary search as ImageHandler._reduceDirect
+        lo = 0
+        hi = levels
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            rounds += 1
+            if mid <= accepted:
+                lo = mid
+            else:
+                hi = mid - 1
+    elif width > minwidth and height > minheight:
+        # the descent scores every accepted level and the first failing one
+        rounds = accepted + 1
+
+    return rounds + 1
+
+
+def expectedBytesSaved(
+    width: int,
+    height: int,
+    bytesPerPixel: int,
+    minwidth: int,
+    minheight: int,
+    acceptedLevels: int = expectedAcceptedLevels,
+) -> float:
+    """
+    Estimates how many bytes of VRAM we save by reducing a texture,
+    if the search accepts acceptedLevels halvings.
+    """
+    accepted = min(acceptedLevels, maxLevels(width, height, minwidth, minheight))
+    return width * height * bytesPerPixel * (1.0 - 0.25**accepted)
+
+
+class TimeBudget:
+    """
+    Wall-clock budget for a run.
+    The time of a work round is fitted as c0 + c1 * pixels to the textures
+    measured so far, to predict whether a texture fits into what's left of the budget
+    and to rank the remaining textures by bytes saved per second.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.startTime = time.time()
+        # sums for a least squares fit of seconds per round against pixels,
+        # weighted by the number of rounds
+        self._w = 0.0
+        self._wx = 0.0
+        self._wy = 0.0
+        self._wxx = 0.0
+        self._wxy = 0.0
+        self._rankedFixedShare: float | None = None
+
+    def elapsed(self) -> float:
+        return time.time() - self.startTime
+
+    def remaining(self) -> float:
+        return self.seconds - self.elapsed()
+
+    def record(self, rounds: int, pixels: int, seconds: float):
+        if rounds <= 0:
+            return
+        y = seconds / rounds
+        self._w += rounds
+        self._wx += rounds * pixels
+        self._wy += rounds * y
+        self._wxx += rounds * pixels * pixels
+        self._wxy += rounds * pixels * y
+
+    def coefficients(self) -> tuple[float, float] | None:
+        """
+        Returns the fixed seconds and the seconds per pixel of a work round,
+        or None if nothing was measured yet.
+        """
+        if self._w == 0.0:
+            return None
+
+        meanX = self._wx / self._w
+        meanY = self._wy / self._w
+        varX = self._wxx / self._w - meanX * meanX
+        if varX > 1e-6 * meanX * meanX:
+            c1 = (self._wxy / self._w - meanX * meanY) / varX
+            c0 = meanY - c1 * meanX
+            if c1 < 0.0:
+                return meanY, 0.0
+            if c0 >= 0.0:
+                return c0, c1
+
+        # not enough different sizes to tell them apart, assume it's all per pixel
+        if self._wxx == 0.0:
+            return meanY, 0.0
+        return 0.0, self._wxy / self._wxx
+
+    def estimateSeconds(self, rounds: int, pixels: int) -> float | None:
+        """
+        Returns the expected time for the given work,
+        or None if nothing was measured yet.
+        """
+        c = self.coefficients()
+        if c is None:
+            return None
+        return rounds * (c[0] + c[1] * pixels)
+
+    def payoff(self, bytesSaved: float, rounds: int, pixels: int) -> float:
+        """
+        Returns the expected bytes saved per second.
+        Before anything is measured, every work round is assumed to cost the same.
+        """
+        estimate = self.estimateSeconds(rounds, pixels)
+        if estimate is None:
+            return bytesSaved / max(rounds, 1)
+        return bytesSaved / max(estimate, 1e-9)
+
+    def rankingChanged(self) -> bool:
+        """
+        Whether the fit changed enough since the last call that returned True
+        (or since the start) to reorder the remaining work by payoff.
+        The order only depends on how much of a round's time is fixed.
+        """
+        c = self.coefficients()
+        if c is None:
+            return False
+        meanX = self._wx / self._w
+        total = c[0] + c[1] * meanX
+        fixedShare = c[0] / total if total > 0.0 else 1.0
+        if (
+            self._rankedFixedShare is not None
+            and abs(fixedShare - self._rankedFixedShare) < 0.05
+        ):
+            return False
+        self._rankedFixedShare = fixedShare
+        return True
+
+    def fits(self, rounds: int, pixels: int, reservedSeconds: float = 0.0) -> bool:
+        """
+        Whether work of this size is expected to finish within the budget,
+        after reservedSeconds for work that is still running in the background.
+        """
+        remaining = self.remaining() - reservedSeconds
+        if remaining <= 0.0:
+            return False
+        estimate = self.estimateSeconds(rounds, pixels)
+        return estimate is None or estimate <= remaining
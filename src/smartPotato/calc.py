@@ -13,3 +13,34 @@ def vecDiff(a: np.ndarray, b: np.ndarray) -> float:
         The difference between the two vectors.
     """
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def normalizeRows(m: np.ndarray) -> np.ndarray:
+    """
+    Scales each row of the matrix to unit length.
+    Zero rows are left as they are.
+
+    Args:
+        m: The matrix, or a single vector.
+
+    Returns:
+        The normalized float32 matrix.
+    """
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0.0, 1.0, norms)
+
+
+def rescaleSimilarity(a):
+    """
+    Maps cosine similarities to our quality scale,
+    where only very similar vectors get a quality close to 1.
+
+    Args:
+        a: The cosine similarity, as a scalar or an array.
+
+    Returns:
+        The rescaled similarity, with the same shape as a.
+    """
+    a = np.clip(a, -0.9999999, 0.9999999)
+    return 1.0 - np.sin(np.arccos(a))
@@ -0,0 +1,184 @@
+import json
+import numpy as np
+
+from .calc import *
+from .texture import Texture
+
+
+class EmbeddingStore:
+    """
+    Keeps normalized float32 embeddings of many textures in one contiguous matrix,
+    for comparing whole texture packs at once.
+    Similarities are rescaled the same way as Texture.similarityTo.
+    """
+
+    def __init__(self, dimension: int | None = None):
+        self.keys: list[str] = []
+        self._keyIndices: dict[str, int] = {}
+        self._matrix: np.ndarray | None = None
+        if dimension is not None:
+            self._matrix = np.empty((0, dimension), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The normalized embeddings, one row per key.
+        """
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[: len(self.keys)]
+
+    def index(self, key: str) -> int:
+        return self._keyIndices[key]
+
+    def embedding(self, key: str) -> np.ndarray:
+        return self.matrix[self.index(key)]
+
+    def _reserve(self, count: int, dimension: int):
+        if self._matrix is None:
+            self._matrix = np.empty((count, dimension), dtype=np.float32)
+            return
+
+        assert (
+            self._matrix.shape[1] == dimension
+        ), f"Embedding dimension {dimension} doesn't match the store's {self._matrix.shape[1]}"
+
+        # grow by doubling, this also copies memory mapped stores into memory
+        if count > self._matrix.shape[0] or not self._matrix.flags.writeable:
+            capacity = max(count, 2 * self._matrix.shape[0])
+            grown = np.empty((capacity, dimension), dtype=np.float32)
+            grown[: len(self.keys)] = self._matrix[: len(self.keys)]
+            self._matrix = grown
+
+    def addMany(self, keys: list[str], embeddings: np.ndarray):
+        """
+        Adds the embeddings (one row per key). Existing keys get replaced.
+        """
+        embeddings = normalizeRows(np.asarray(embeddings).reshape(len(keys), -1))
+
+        newKeys = [k for k in dict.fromkeys(keys) if k not in self._keyIndices]
+        self._reserve(len(self.keys) + len(newKeys), embeddings.shape[1])
+        for k in newKeys:
+            self._keyIndices[k] = len(self.keys)
+            self.keys.append(k)
+
+        self._matrix[[self._keyIndices[k] for k in keys]] = embeddings
+
+    def add(self, key: str, embedding: np.ndarray):
+        self.addMany([key], embedding)
+
+    def addTexture(self, key: str, texture: Texture):
+        self.add(key, texture.getEmbedding())
+
+    def similarities(self, embedding: np.ndarray) -> np.ndarray:
+        """
+        Returns the similarity of the embedding to each stored embedding.
+        """
+        return self.similaritiesMany(np.asarray(embedding).reshape(1, -1))[0]
+
+    def _chunkSize(self, maxChunkBytes: int, bytesPerSimilarity: int) -> int:
+        """
+        How many queries to compare at once, so their similarities
+        and the temporaries take about maxChunkBytes.
+        """
+        return max(1, maxChunkBytes // (len(self) * bytesPerSimilarity))
+
+    def similaritiesMany(
+        self, embeddings: np.ndarray, maxChunkBytes: int = 256 * 1024 * 1024
+    ) -> np.ndarray:
+        """
+        Returns the similarities of the embeddings (one per row)
+        to each stored embedding, as a matrix of shape (len(embeddings), len(self)).
+        Queries are processed in chunks, so the temporaries of the rescaling
+        take about maxChunkBytes at a time. The result itself still takes
+        4 bytes per pair, use topKMany when only the closest ones are needed.
+        """
+        embeddings = np.asarray(embeddings)
+        embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+        sims = np.empty((len(embeddings), len(self)), dtype=np.float32)
+        if len(self) == 0:
+            return sims
+
+        # the cosine similarity and up to two rescaling steps at once
+        chunkSize = self._chunkSize(maxChunkBytes, 3 * np.dtype(np.float32).itemsize)
+        for start in range(0, len(embeddings), chunkSize):
+            chunk = normalizeRows(embeddings[start : start + chunkSize])
+            sims[start : start + len(chunk)] = rescaleSimilarity(chunk @ self.matrix.T)
+        return sims
+
+    def topK(self, embedding: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """
+        Returns the keys of the k most similar stored embeddings
+        and their similarities, most similar first.
+        """
+        indices, sims = self.topKMany(np.asarray(embedding).reshape(1, -1), k)
+        return [(self.keys[i], float(s)) for i, s in zip(indices[0], sims[0])]
+
+    def topKMany(
+        self, embeddings: np.ndarray, k: int, maxChunkBytes: int = 256 * 1024 * 1024
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k most similar stored embeddings for each of the embeddings.
+        Queries are processed in chunks, so the similarity matrix and its
+        temporaries take about maxChunkBytes at a time.
+
+        The ranking uses the cosine similarity, because the rescaled similarity
+        isn't monotonic for opposite vectors. Only the found ones get rescaled.
+
+        Returns:
+            The indices of the found embeddings, and their similarities,
+            both of shape (len(embeddings), k) and sorted by cosine similarity,
+            most similar first.
+        """
+        embeddings = np.asarray(embeddings)
+        embeddings = embeddings.reshape(-1, embeddings.shape[-1])
+        k = max(0, min(k, len(self)))
+        indices = np.empty((len(embeddings), k), dtype=np.intp)
+        sims = np.empty((len(embeddings), k), dtype=np.float32)
+        if k == 0:
+            return indices, sims
+
+        # a float32 similarity and an index from argpartition per stored embedding
+        chunkSize = self._chunkSize(
+            maxChunkBytes, np.dtype(np.float32).itemsize + np.dtype(np.intp).itemsize
+        )
+
+        for start in range(0, len(embeddings), chunkSize):
+            chunk = normalizeRows(embeddings[start : start + chunkSize])
+            chunkCos = chunk @ self.matrix.T
+            top = np.argpartition(chunkCos, len(self) - k, axis=1)[:, len(self) - k :]
+            topCos = np.take_along_axis(chunkCos, top, axis=1)
+            order = np.argsort(-topCos, axis=1, kind="stable")
+            indices[start : start + len(chunkCos)] = np.take_along_axis(
+                top, order, axis=1
+            )
+            sims[start : start + len(chunkCos)] = rescaleSimilarity(
+                np.take_along_axis(topCos, order, axis=1)
+            )
+
+        return indices, sims
+
+    def save(self, path: str):
+        """
+        Saves the embeddings to path (a .npy file) and the keys next to it.
+        """
+        with open(path, "wb") as fp:
+            np.save(fp, self.matrix)
+        with open(path + ".keys.json", "w") as fp:
+            json.dump(self.keys, fp)
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> "EmbeddingStore":
+        """
+        Loads a store saved with save.
+        If mmap, the embeddings are memory mapped instead of read into memory.
+        """
+        store = EmbeddingStore()
+        store._matrix = np.load(path, mmap_mode="r" if mmap else None)
+        with open(path + ".keys.json", "r") as fp:
+            store.keys = json.load(fp)
+        store._keyIndices = {k: i for i, k in enumerate(store.keys)}
+        return store
@@ -0,0 +1,163 @@
+from PIL import Image as im
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from os import path as pt
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+
+@dataclass
+class EncodeJob:
+    image: im.Image
+    compressionOpt: str
+    path: str
+
+
+@dataclass
+class EncodeFailure:
+    path: str
+    message: str
+
+
+class EncoderPool:
+    """
+    Runs nvcompress for DDS outputs in the background,
+    with at most maxProcesses encoders running at once.
+    Each job gets its own temporary input file.
+
+    If batchSize > 1, jobs with the same compression option are passed
+    to a single nvcompress call as input/output pairs.
+    Only use that if your nvcompress version accepts several files per call.
+
+    At most maxPending jobs (but at least enough to fill every process's batch)
+    are queued, submit blocks until one finishes,
+    so queued images don't pile up in memory when encoding is the slower part.
+    """
+
+    def __init__(
+        self,
+        nvcompressPath: str,
+        maxProcesses: int,
+        batchSize: int = 1,
+        maxPending: int = 8,
+    ):
+        self.nvcompressPath = nvcompressPath
+        self.batchSize = batchSize
+        self.maxProcesses = maxProcesses
+        self._executor = ThreadPoolExecutor(max_workers=maxProcesses)
+        self._slots = threading.Semaphore(max(maxPending, maxProcesses * batchSize))
+        self._tempdir = tempfile.TemporaryDirectory(prefix="smartPotato-nvtt-")
+        self._pending: dict[str, list[EncodeJob]] = {}
+        self._futures: list[Future] = []
+        self._failures: list[EncodeFailure] = []
+        self._lock = threading.Lock()
+        self._submitLock = threading.Lock()
+        self._pendingCount = 0
+        self._doneCount = 0
+        self._doneSeconds = 0.0
+
+    def submit(self, image: im.Image, compressionOpt: str, path: str):
+        """
+        Queues the image to be encoded into the DDS file at path.
+        Blocks while too many jobs are pending.
+        Safe to call from several threads.
+        """
+        if not self._slots.acquire(blocking=False):
+            # incomplete batches would never free their slots, so send them off
+            with self._submitLock:
+                for pendingOpt in list(self._pending.keys()):
+                    self._flush(pendingOpt)
+            self._slots.acquire()
+        with self._lock:
+            self._pendingCount += 1
+
+        with self._submitLock:
+            batch = self._pending.setdefault(compressionOpt, [])
+            batch.append(EncodeJob(image, compressionOpt, path))
+            if len(batch) >= self.batchSize:
+                self._flush(compressionOpt)
+
+    def _flush(self, compressionOpt: str):
+        batch = self._pending.pop(compressionOpt, [])
+        if len(batch):
+            self._futures.append(self._executor.submit(self._encode, batch))
+
+    def _fail(self, path: str, message: str):
+        with self._lock:
+            self._failures.append(EncodeFailure(path, message))
+
+    def _encode(self, batch: list[EncodeJob]):
+        args = [self.nvcompressPath, batch[0].compressionOpt, "-production"]
+        inputPaths: list[str] = []
+        startTime = time.time()
+
+        try:
+            for job in batch:
+                fd, inputPath = tempfile.mkstemp(suffix=".png", dir=self._tempdir.name)
+                os.close(fd)
+                inputPaths.append(inputPath)
+                # the temporary input only needs to be fast to write
+                job.image.save(inputPath, compress_level=1)
+                args += [inputPath, job.path]
+
+                # so a stale output isn't mistaken for a result
+                if pt.isfile(job.path):
+                    os.remove(job.path)
+
+            p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = p.stdout.decode("utf-8", errors="replace").strip()
+
+            # in a batch, the files that were produced are the ones that succeeded
+            for job in batch:
+                if p.returncode != 0 and (len(batch) == 1 or not pt.isfile(job.path)):
+                    self._fail(
+                        job.path, f"nvcompress exited with {p.returncode}: {output}"
+                    )
+                elif not pt.isfile(job.path):
+                    self._fail(job.path, f"nvcompress didn't produce a file: {output}")
+        except Exception as e:
+            for job in batch:
+                self._fail(job.path, str(e))
+        finally:
+            with self._lock:
+                self._pendingCount -= len(batch)
+                self._doneCount += len(batch)
+                self._doneSeconds += time.time() - startTime
+            for _ in batch:
+                self._slots.release()
+            for inputPath in inputPaths:
+                os.remove(inputPath)
+
+    def estimateDrainSeconds(self) -> float:
+        """
+        Estimates how long the queued jobs take to finish,
+        from the time the finished jobs took.
+        """
+        with self._lock:
+            if self._doneCount == 0:
+                return 0.0
+            jobSeconds = self._doneSeconds / self._doneCount
+            return self._pendingCount * jobSeconds / self.maxProcesses
+
+    def wait(self) -> list[EncodeFailure]:
+        """
+        Waits for all queued jobs to finish.
+
+        Returns:
+            The failures of all jobs so far, one per output file.
+        """
+        with self._submitLock:
+            for compressionOpt in list(self._pending.keys()):
+                self._flush(compressionOpt)
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+        return list(self._failures)
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+        self._tempdir.cleanup()
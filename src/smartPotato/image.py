@@ -1,12 +1,16 @@
 from PIL import Image as im
 from dataclasses import dataclass
 from os import path as pt
+from typing import BinaryIO
 import io
 import os
+import struct
 import wand.image as wimage
 import subprocess
 import tempfile
 
+from .encoderPool import *
+from .output import *
 from .texture import *
 
 # Create a temp directory
@@ -14,6 +18,7 @@ tempdir = tempfile.TemporaryDirectory(suffix=None, prefix=None, dir=None)
 tempImageFilepath = pt.join(tempdir.name, "image.png")
 with open(tempImageFilepath, "w") as fp:
     pass
+tempDDSFilepath = pt.join(tempdir.name, "image.dds")
 
 # Get a set of supported file extensions
 supported_extensions = {
@@ -27,6 +32,33 @@ def isSupportedImage(file_path):
     return file_extension.lower() in supported_extensions
 
 
+def probeImage(file_path, fp: BinaryIO | None = None) -> tuple[int, int, int]:
+    """
+    Reads only the image header, from fp if given or else from file_path.
+
+    Returns:
+        The width, height and number of bytes per pixel of the image.
+    """
+    if pt.splitext(file_path)[1].lower() == ".dds":
+        # DDS sizes can be read without the texture tools
+        if fp is None:
+            with open(file_path, "rb") as ddsfp:
+                header = ddsfp.read(20)
+        else:
+            header = fp.read(20)
+        assert header[0:4] == b"DDS ", f"'{file_path}' is not a DDS file"
+        height, width = struct.unpack("<II", header[12:20])
+        return width, height, 4
+
+    with im.open(fp if fp is not None else file_path) as img:
+        return img.width, img.height, len(img.getbands())
+
+
+# amounts of increased detail tried for each halving, blended with the
+# non-detailed texture (0, just sharpened and halved, is always tried too)
+detailBlendSteps = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+
+
 @dataclass
 class ConversionData:
     width: int
@@ -44,7 +76,11 @@ class NVTT:
 
 class ImageHandler:
 
-    def __init__(self, file_path, nvttDirInfo: NVTT):
+    def __init__(self, file_path, nvttDirInfo: NVTT, data: bytes | None = None):
+        """
+        Loads the image from file_path,
+        or from data if given (file_path is then only used for its name)
+        """
         self.filepath = file_path
         self.nvttDirInfo = nvttDirInfo
         if pt.splitext(self.filepath)[1].lower() == ".dds":
@@ -52,8 +88,15 @@ class ImageHandler:
                 nvttDirInfo is not None
             ), "Please provide an NVidia Texture Tools directory for DDS handling. Skipping!"
 
+            # the texture tools only work with files
+            ddsFilepath = self.filepath
+            if data is not None:
+                ddsFilepath = tempDDSFilepath
+                with open(ddsFilepath, "wb") as fp:
+                    fp.write(data)
+
             p = subprocess.Popen(
-                [nvttDirInfo.nvddsinfoPath, self.filepath],
+                [nvttDirInfo.nvddsinfoPath, ddsFilepath],
                 stdout=subprocess.PIPE,
             )
             pout, _ = p.communicate()
@@ -87,84 +130,283 @@ class ImageHandler:
                     nvttDirInfo.nvdecompressPath,
                     "-format",
                     "png",
-                    self.filepath,
+                    ddsFilepath,
                     tempImageFilepath,
                 ]
             )
             self.texture = Texture(im.open(tempImageFilepath))
             os.remove(tempImageFilepath)
+            if data is not None:
+                os.remove(ddsFilepath)
+        elif data is not None:
+            self.texture = Texture(im.open(io.BytesIO(data)))
         else:
             self.texture = Texture(im.open(file_path))
 
     def getIdentityData(self) -> tuple[Texture, ConversionData]:
-        width, height = self.texture.image.size
+        width, height = self.texture.width, self.texture.height
         return self.texture, ConversionData(width, height, 1.0)
 
-    def saveReplacement(self, texture: Texture, path: str):
-        self.texture = texture
+    def saveReplacement(
+        self,
+        texture: Texture,
+        path: str | BinaryIO,
+        encoderPool: EncoderPool | None = None,
+        profile: str = "balanced",
+    ):
+        """
+        Saves the texture to path, which is either a filename
+        or a binary file object (the format then follows our filepath).
+        profile selects the encoding options, see output.encodingProfiles.
+        DDS files saved to a filename are encoded in encoderPool if given,
+        check its failures after waiting for it.
+        The handler itself isn't modified, so several textures of it
+        can be saved from background threads at once.
+        """
+        extension = pt.splitext(self.filepath)[1].lower()
+        imageFormat = im.registered_extensions()[extension]
 
-        if pt.splitext(self.filepath)[1].lower() == ".dds":
-            self.texture.image.save(tempImageFilepath)
+        if extension == ".dds" and encoderPool is not None and isinstance(path, str):
+            encoderPool.submit(texture.image, self.compressionOpt, path)
+
+        elif extension == ".dds":
+            # own temp files, so saves can run in parallel
+            fd, pngFilepath = tempfile.mkstemp(suffix=".png", dir=tempdir.name)
+            os.close(fd)
+            if isinstance(path, str):
+                ddsFilepath = path
+            else:
+                fd, ddsFilepath = tempfile.mkstemp(suffix=".dds", dir=tempdir.name)
+                os.close(fd)
+
+            # the temporary input only needs to be fast to write
+            texture.image.save(pngFilepath, **saveOptions("fast", "PNG"))
             subprocess.call(
                 [
                     self.nvttDirInfo.nvcompressPath,
                     self.compressionOpt,
                     "-production",
-                    tempImageFilepath,
-                    path,
+                    pngFilepath,
+                    ddsFilepath,
                 ]
             )
-            os.remove(tempImageFilepath)
+            os.remove(pngFilepath)
 
+            if not isinstance(path, str):
+                with open(ddsFilepath, "rb") as fp:
+                    path.write(fp.read())
+                os.remove(ddsFilepath)
+
+        elif isinstance(path, str):
+            texture.image.save(path, **saveOptions(profile, imageFormat))
         else:
-            self.texture.image.save(path)
+            texture.image.save(
+                path, format=imageFormat, **saveOptions(profile, imageFormat)
+            )
+
+    def _bestDetailBlend(
+        self, nonDetTex: Texture, ogTex: Texture
+    ) -> tuple[Texture, float]:
+        """
+        Increases the detail of nonDetTex and finds the best amount
+        by blending with the non-detailed version.
+        Returns the best texture and its quality compared to ogTex.
+        """
+        detTex = nonDetTex.transformIncreaseDetail(1)
+
+        candidates = [nonDetTex] + nonDetTex.transformFadedToMany(
+            detTex, detailBlendSteps
+        )
+        return self._bestCandidate(candidates, ogTex)
+
+    def _bestCandidate(
+        self, candidates: list[Texture], ogTex: Texture
+    ) -> tuple[Texture, float]:
+        """
+        Scores the candidates at the resolution of ogTex, as one scoring round.
+        Returns the best one (the first one on ties) and its quality compared to ogTex.
+        """
+        # the candidates are embedded in one batch
+        embeddings = Texture.embeddingsMany(
+            [t.transformResolution(ogTex.width, ogTex.height) for t in candidates]
+        )
+        ogEmbedding = ogTex.getEmbedding()
+        quals = [
+            float(rescaleSimilarity(vecDiff(embedding, ogEmbedding)))
+            for embedding in embeddings
+        ]
+
+        bestTex = candidates[0]
+        bestQual = quals[0]
+
+        for t, qual in zip(candidates[1:], quals[1:]):
+            if qual > bestQual:
+                bestTex = t
+                bestQual = qual
+
+        return bestTex, bestQual
 
     def reduce(
-        self, minwidth: int, minheight: int, minquality: float
+        self,
+        minwidth: int,
+        minheight: int,
+        minquality: float,
+        searchMode: str = "descent",
     ) -> tuple[Texture, ConversionData]:
+        """
+        Reduces the texture as much as possible while keeping at least minquality.
+
+        searchMode selects the search strategy:
+            "descent": halve one level at a time, deriving each level from the
+                previous accepted one
+            "direct": derive candidate levels directly from the original
+                and binary search the level count
+        """
+        return self.reduceTiers(minwidth, minheight, [minquality], searchMode)[0]
+
+    def reduceTiers(
+        self,
+        minwidth: int,
+        minheight: int,
+        minqualities: list[float],
+        searchMode: str = "descent",
+    ) -> list[tuple[Texture, ConversionData]]:
+        """
+        Like reduce, but for several minimal qualities at once.
+        A single search is shared by all of them, and the results are the same
+        as calling reduce for each one.
+
+        Returns:
+            The reduced texture and its conversion data for each of minqualities.
+        """
+        if searchMode == "descent":
+            return self._reduceDescent(minwidth, minheight, minqualities)
+        elif searchMode == "direct":
+            return self._reduceDirect(minwidth, minheight, minqualities)
+        else:
+            raise ValueError(f"Unknown search mode '{searchMode}'")
+
+    def _reduceDescent(
+        self, minwidth: int, minheight: int, minqualities: list[float]
+    ) -> list[tuple[Texture, ConversionData]]:
         # We will use a special method consisting of sharpening the image,
         # reducing its resolution and then increasing its detail by a variable amount.
+        # Each level only depends on the previous one, so we descend until
+        # the lowest minquality fails, and every other minquality stops
+        # at its first failing level on the way.
 
         ogTex = self.texture
         curTex = ogTex
         curQual = 1.0
         newTex = curTex
         newQual = curQual
+        lowestQuality = min(minqualities)
+
+        # accepted levels, starting with the original
+        levels: list[tuple[Texture, float]] = []
 
         while (
-            newQual > minquality
-            and newTex.image.width > minwidth
-            and newTex.image.height > minheight
+            newQual > lowestQuality
+            and newTex.width > minwidth
+            and newTex.height > minheight
         ):
             # accept the new texture
             curTex = newTex
             curQual = newQual
+            levels.append((curTex, curQual))
 
             # reduce resolution without increasing detail
             nonDetTex = curTex.transformSharpen(1).transformResolution(
-                curTex.image.width // 2, curTex.image.height // 2
+                curTex.width // 2, curTex.height // 2
             )
 
             # now increase detail, and find the best amount by blending with nonDetTex
-            detTex = nonDetTex.transformIncreaseDetail(1)
-            blendSteps = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
-
-            bestTex = nonDetTex
-            bestQual = nonDetTex.transformResolution(
-                ogTex.image.width, ogTex.image.height
-            ).similarityTo(ogTex)
-
-            for a in blendSteps:
-                t = nonDetTex.transformFadedTo(detTex, a)
-                qual = t.transformResolution(
-                    ogTex.image.width, ogTex.image.height
-                ).similarityTo(ogTex)
-                if qual > bestQual:
-                    bestTex = t
-                    bestQual = qual
-
             # select the best quality of our options, but don't accept it yet
-            newTex = bestTex
-            newQual = bestQual
+            newTex, newQual = self._bestDetailBlend(nonDetTex, ogTex)
+
+        if not len(levels):
+            levels.append((ogTex, 1.0))
+
+        results: list[tuple[Texture, ConversionData]] = []
+        for minquality in minqualities:
+            curTex, curQual = levels[0]
+            for tex, qual in levels[1:]:
+                if qual <= minquality:
+                    break
+                curTex, curQual = tex, qual
+            results.append(
+                (curTex, ConversionData(curTex.width, curTex.height, curQual))
+            )
+        return results
 
-        return curTex, ConversionData(curTex.image.width, curTex.image.height, curQual)
+    def _reduceDirect(
+        self, minwidth: int, minheight: int, minqualities: list[float]
+    ) -> list[tuple[Texture, ConversionData]]:
+        # Same sharpen-reduce-detail recipe, but each candidate level is derived
+        # from the original by repeating the whole recipe level times,
+        # once for each detail blend amount, and the amounts are compared
+        # at the final level only.
+        # The level count is binary searched, so the number of scoring rounds
+        # is logarithmic in the number of levels.
+        # Scored levels are shared between the searches for each minquality.
+
+        ogTex = self.texture
+
+        # the deepest level we're allowed to produce
+        maxLevel = 0
+        while (ogTex.width >> (maxLevel + 1)) > minwidth and (
+            ogTex.height >> (maxLevel + 1)
+        ) > minheight:
+            maxLevel += 1
+
+        # the levels of each blend amount, derived lazily
+        blendAmounts = [0.0] + detailBlendSteps
+        blendLevels: dict[float, list[Texture]] = {a: [ogTex] for a in blendAmounts}
+        # the first halving doesn't depend on the amount, so it's shared
+        firstHalving: list[Texture] = []
+
+        def blendLevel(amount: float, level: int) -> Texture:
+            levels = blendLevels[amount]
+            while len(levels) <= level:
+                prevTex = levels[-1]
+                if len(levels) == 1 and len(firstHalving):
+                    nonDetTex, detTex = firstHalving
+                else:
+                    nonDetTex = prevTex.transformSharpen(1).transformResolution(
+                        prevTex.width // 2, prevTex.height // 2
+                    )
+                    if amount == 0.0 and len(levels) > 1:
+                        detTex = nonDetTex
+                    else:
+                        detTex = nonDetTex.transformIncreaseDetail(1)
+                    if len(levels) == 1:
+                        firstHalving.extend([nonDetTex, detTex])
+                levels.append(nonDetTex.transformFadedTo(detTex, amount))
+            return levels[level]
+
+        scoredLevels: dict[int, tuple[Texture, float]] = {0: (ogTex, 1.0)}
+
+        def scoreLevel(level: int) -> tuple[Texture, float]:
+            if level not in scoredLevels:
+                scoredLevels[level] = self._bestCandidate(
+                    [blendLevel(a, level) for a in blendAmounts], ogTex
+                )
+            return scoredLevels[level]
+
+        results: list[tuple[Texture, ConversionData]] = []
+        for minquality in minqualities:
+            # find the deepest level that still keeps the quality
+            lo = 0
+            hi = maxLevel
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if scoreLevel(mid)[1] > minquality:
+                    lo = mid
+                else:
+                    hi = mid - 1
+
+            curTex, curQual = scoredLevels[lo]
+            results.append(
+                (curTex, ConversionData(curTex.width, curTex.height, curQual))
+            )
+        return results
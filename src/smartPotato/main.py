@@ -1,9 +1,17 @@
 from typing import Iterable, Iterator
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import functools
+import io
 import os
 import sys
+import threading
+import time
+import zipfile
 
+from .archive import *
+from .budget import *
 from .image import *
+from .output import *
 from .texture import *
 
 
@@ -41,10 +49,32 @@ def main():
 
         absolutePrefix: str
         filepath: str
+        archive: zipfile.ZipFile | None = None
+
+    @dataclass
+    class Tier:
+        """
+        Output and stats for one of the reduceby values
+        """
+
+        reduceBy: float
+        outputPrefix: str
+        outputArchivePath: str | None
+        outputArchive: zipfile.ZipFile | None = None
+        writtenMembers: set[str] = field(default_factory=set)
+        # ZipFile can't write several members at once, writer threads take turns
+        archiveLock: threading.Lock = field(default_factory=threading.Lock)
+        newTotalPixels: int = 0
+        newQualSum: float = 0.0
+        newMinQual: float = 1.0
+        modifiedImageCount: int = 0
 
     # list of files we process
     filenameList: list[FileSpec] = []
 
+    # archives we read from
+    inputArchives: list[zipfile.ZipFile] = []
+
     # launch params
 
     # --file
@@ -61,8 +91,23 @@ def main():
     # --directory
     def opt_directory(args: Iterator[str]):
         nonlocal filenameList
+        nonlocal inputArchives
 
         d = next(args)
+
+        if os.path.isfile(d):
+            assert isArchive(d), f"'{d}' is not recognized as an archive"
+
+            archive = zipfile.ZipFile(d)
+            inputArchives.append(archive)
+            filenameList.extend(
+                [
+                    FileSpec(absolutePath(d), member, archive)
+                    for member in listSupportedMembers(archive)
+                ]
+            )
+            return
+
         assert os.path.isdir(d), f"'{d}' is not recognized as a directory"
 
         filenameList.extend(
@@ -76,36 +121,55 @@ def main():
 
     # --output
     outputPrefix = os.path.curdir
+    outputArchivePath: str | None = None
 
     def opt_output(args: Iterator[str]):
         nonlocal outputPrefix
+        nonlocal outputArchivePath
 
         d = next(args)
+
+        if not os.path.isdir(d) and isArchive(d):
+            assert os.path.isdir(
+                os.path.dirname(absolutePath(d))
+            ), f"'{d}' is not in a(n existing) directory"
+
+            outputArchivePath = d
+            return
+
         assert os.path.isdir(d), f"'{d}' is not recognized as a(n existing) directory"
 
         outputPrefix = d
 
     # --reduceto
     shouldReduce = False
-    reduceBy = 0.0
+    reduceByTiers: list[float] = []
 
     def opt_reduceby(args: Iterator[str]):
         nonlocal shouldReduce
-        nonlocal reduceBy
+        nonlocal reduceByTiers
 
-        arg = next(args)
-        factor = 1.0
+        reduceByTiers = []
+        for arg in next(args).split(","):
+            factor = 1.0
 
-        if arg.endswith("%"):
-            factor = 0.01
-            arg = arg[:-1]
+            if arg.endswith("%"):
+                factor = 0.01
+                arg = arg[:-1]
 
-        reduceBy = float(arg) * factor
-        shouldReduce = True
+            reduceBy = float(arg) * factor
 
-        assert (
-            reduceBy >= 0.0 and reduceBy < 1.0
-        ), "reduceby must be between 0.0 (inclusive) and 1.0 (exclusive)"
+            assert (
+                reduceBy >= 0.0 and reduceBy < 1.0
+            ), "reduceby must be between 0.0 (inclusive) and 1.0 (exclusive)"
+
+            # values like 10% and 0.1 would write to the same tier output
+            if any(f"{r*100.0:g}" == f"{reduceBy*100.0:g}" for r in reduceByTiers):
+                continue
+
+            reduceByTiers.append(reduceBy)
+
+        shouldReduce = True
 
     # --mindimension
     minDimension = 32
@@ -117,6 +181,63 @@ def main():
 
         assert minDimension > 2, "minDimension must be greater than 2"
 
+    # --search
+    searchMode = "descent"
+
+    def opt_search(args: Iterator[str]):
+        nonlocal searchMode
+
+        searchMode = next(args)
+
+        assert searchMode in (
+            "descent",
+            "direct",
+        ), "search must be either 'descent' or 'direct'"
+
+    # --time-budget
+    timeBudgetSeconds: float | None = None
+
+    def opt_timebudget(args: Iterator[str]):
+        nonlocal timeBudgetSeconds
+
+        arg = next(args)
+        factor = 1.0
+
+        if arg.endswith("h"):
+            factor = 3600.0
+            arg = arg[:-1]
+        elif arg.endswith("m"):
+            factor = 60.0
+            arg = arg[:-1]
+        elif arg.endswith("s"):
+            arg = arg[:-1]
+
+        timeBudgetSeconds = float(arg) * factor
+
+        assert timeBudgetSeconds > 0.0, "time-budget must be greater than 0"
+
+    # --profile
+    encodingProfile = "balanced"
+
+    def opt_profile(args: Iterator[str]):
+        nonlocal encodingProfile
+
+        encodingProfile = next(args)
+
+        assert (
+            encodingProfile in encodingProfiles
+        ), f"profile must be one of {', '.join(encodingProfiles.keys())}"
+
+    # --writers
+    writerThreads = 1
+
+    def opt_writers(args: Iterator[str]):
+        nonlocal writerThreads
+
+        writerThreads = int(next(args))
+
+        assert writerThreads > 0, "writers must be greater than 0"
+
     # --verbose
     verbose = False
 
@@ -160,6 +281,26 @@ def main():
 
         nvttDirInfo = NVTT(nvttDir, nvdecompressPath, nvcompressPath, nvddsinfoPath)
 
+    # --nvttjobs
+    nvttJobs = os.cpu_count() or 1
+
+    def opt_nvttjobs(args: Iterator[str]):
+        nonlocal nvttJobs
+
+        nvttJobs = int(next(args))
+
+        assert nvttJobs > 0, "nvttjobs must be greater than 0"
+
+    # --nvttbatch
+    nvttBatch = 1
+
+    def opt_nvttbatch(args: Iterator[str]):
+        nonlocal nvttBatch
+
+        nvttBatch = int(next(args))
+
+        assert nvttBatch > 0, "nvttbatch must be greater than 0"
+
     # Option list
     supportedOptions = {
         "--file": opt_file,
@@ -172,8 +313,14 @@ def main():
         "-r": opt_reduceby,
         "--mindimension": opt_mindimension,
         "-m": opt_mindimension,
+        "--search": opt_search,
+        "--time-budget": opt_timebudget,
+        "--profile": opt_profile,
+        "--writers": opt_writers,
         "--verbose": opt_verbose,
         "--nvtt": opt_nvtt,
+        "--nvttjobs": opt_nvttjobs,
+        "--nvttbatch": opt_nvttbatch,
     }
 
     # parse argvs and execute the related functions
@@ -209,29 +356,142 @@ def main():
 
     # reduce if requested
     ogTotalPixels = 0
-    newTotalPixels = 0
-    newQualSum = 0.0
-    newMinQual = 1.0
-    modifiedImageCount = 0
     processedImageCount = 0
+    handledImageCount = 0
+    skippedFiles: list[str] = []
     if shouldReduce:
         if len(filenameList):
-            for f in filenameList:
+            # with a time budget, do the biggest expected wins first,
+            # ranked again as the timings come in
+            timeBudget: TimeBudget | None = None
+            # work rounds, pixels and expected bytes saved of each file
+            fileWork: dict[int, tuple[int, int, float]] = {}
+            # popped from the end
+            pendingFiles = list(reversed(filenameList))
+
+            def filePayoff(f: FileSpec) -> float:
+                rounds, pixels, bytesSaved = fileWork[id(f)]
+                return timeBudget.payoff(bytesSaved, rounds, pixels)
+
+            if timeBudgetSeconds is not None:
+                timeBudget = TimeBudget(timeBudgetSeconds)
+
+                for f in filenameList:
+                    try:
+                        if f.archive is not None:
+                            with f.archive.open(f.filepath) as fp:
+                                w, h, bpp = probeImage(f.filepath, fp)
+                        else:
+                            w, h, bpp = probeImage(
+                                os.path.join(f.absolutePrefix, f.filepath)
+                            )
+                        fileWork[id(f)] = (
+                            workRounds(w, h, minDimension, minDimension, searchMode),
+                            w * h,
+                            expectedBytesSaved(w, h, bpp, minDimension, minDimension),
+                        )
+                    except Exception:
+                        # leave it for last, loading will report the error
+                        fileWork[id(f)] = (1, 0, 0.0)
+
+                pendingFiles.sort(key=filePayoff)
+
+            # with several reduceby values, each gets its own output
+            tiers: list[Tier] = []
+            if len(reduceByTiers) == 1:
+                tiers.append(Tier(reduceByTiers[0], outputPrefix, outputArchivePath))
+            else:
+                for reduceBy in reduceByTiers:
+                    tierName = f"reduceby-{reduceBy*100.0:g}"
+                    tierArchivePath = None
+                    if outputArchivePath is not None:
+                        root, extension = os.path.splitext(outputArchivePath)
+                        tierArchivePath = f"{root}-{tierName}{extension}"
+                    tiers.append(
+                        Tier(
+                            reduceBy,
+                            os.path.join(outputPrefix, tierName),
+                            tierArchivePath,
+                        )
+                    )
+
+            # all results go into new archives if requested
+            for tier in tiers:
+                if tier.outputArchivePath is not None:
+                    if any(
+                        os.path.abspath(a.filename)
+                        == absolutePath(tier.outputArchivePath)
+                        for a in inputArchives
+                    ):
+                        print(
+                            "The output archive can't be one of the input archives",
+                            file=sys.stderr,
+                        )
+                        return
+                    tier.outputArchive = zipfile.ZipFile(
+                        tier.outputArchivePath, "w", zipfile.ZIP_DEFLATED
+                    )
+
+            # DDS files get encoded in the background while we keep reducing
+            encoderPool: EncoderPool | None = None
+            if nvttDirInfo is not None:
+                encoderPool = EncoderPool(nvttDirInfo.nvcompressPath, nvttJobs, nvttBatch)
+
+            # results are saved in the background while we keep reducing
+            writer = BackgroundWriter(writerThreads)
+
+            def saveToArchive(
+                tier: Tier,
+                handler: ImageHandler,
+                texture: Texture,
+                memberName: str,
+                compressType: int,
+            ):
+                buffer = io.BytesIO()
+                handler.saveReplacement(texture, buffer, profile=encodingProfile)
+                with tier.archiveLock:
+                    tier.outputArchive.writestr(
+                        memberName, buffer.getvalue(), compress_type=compressType
+                    )
+                    tier.writtenMembers.add(memberName)
+
+            # to know which tier a failed output belongs to
+            outpathTiers: dict[str, Tier] = {}
+
+            while len(pendingFiles):
+                f = pendingFiles.pop()
                 processedImageCount += 1
 
+                if timeBudget is not None:
+                    # what's still saving in the background needs time as well
+                    reservedSeconds = writer.estimateDrainSeconds()
+                    if encoderPool is not None:
+                        reservedSeconds += encoderPool.estimateDrainSeconds()
+                    rounds, pixels, _ = fileWork[id(f)]
+                    if not timeBudget.fits(rounds, pixels, reservedSeconds):
+                        skippedFiles.append(f.filepath)
+                        continue
+                fileStartTime = time.time()
+
                 try:
-                    # load the file and prepare for output
+                    # load the file
                     inpath = os.path.join(f.absolutePrefix, f.filepath)
-                    outpath = os.path.join(outputPrefix, f.filepath)
 
                     try:
-                        handler = ImageHandler(inpath, nvttDirInfo)
+                        if f.archive is not None:
+                            handler = ImageHandler(
+                                f.filepath,
+                                nvttDirInfo,
+                                f.archive.read(f.filepath),
+                            )
+                        else:
+                            handler = ImageHandler(inpath, nvttDirInfo)
                     except Exception as e:
                         print(f"Error loading {inpath}: {e}", file=sys.stderr)
                         continue
 
                     # stats
-                    ogW, ogH = handler.texture.image.size
+                    ogW, ogH = handler.texture.width, handler.texture.height
                     ogTotalPixels += ogW * ogH
 
                     if verbose:
@@ -239,54 +499,171 @@ def main():
                             f"Handling image {processedImageCount}/{len(filenameList)} {inpath} ({ogW}x{ogH})"
                         )
 
-                    # reduction!
-                    newtex, conversionData = handler.reduce(
-                        minDimension, minDimension, 1.0 - reduceBy
+                    # reduction! one search is shared by all tiers
+                    ogTex = handler.texture
+                    tierResults = handler.reduceTiers(
+                        minDimension,
+                        minDimension,
+                        [1.0 - tier.reduceBy for tier in tiers],
+                        searchMode,
                     )
+                    handledImageCount += 1
+
+                    for tier, (newtex, conversionData) in zip(tiers, tierResults):
+                        if tier.outputArchive is not None:
+                            outpath = f"{tier.outputArchivePath}:{f.filepath}"
+                        else:
+                            outpath = os.path.join(tier.outputPrefix, f.filepath)
+                            # never write outside of the output folder
+                            prefix = os.path.abspath(tier.outputPrefix)
+                            if (
+                                os.path.commonpath([prefix, os.path.abspath(outpath)])
+                                != prefix
+                            ):
+                                print(
+                                    f"Error processing {f.filepath}: output path is outside of '{tier.outputPrefix}'",
+                                    file=sys.stderr,
+                                )
+                                continue
+                        tierPrefix = (
+                            f"[{tier.reduceBy*100.0:g}%] " if len(tiers) > 1 else ""
+                        )
+
+                        # stats
+                        newW, newH = newtex.width, newtex.height
+                        newQual = conversionData.quality
+                        tier.newTotalPixels += newW * newH
+                        tier.newQualSum += newQual
+                        if newQual < tier.newMinQual:
+                            tier.newMinQual = newQual
+
+                        # check if we managed to reduce
+                        if newtex is ogTex:
+                            if verbose:
+                                print(f"    {tierPrefix}Can't reduce, skipping.")
+                            continue
 
-                    # stats
-                    newW, newH = newtex.image.size
-                    newQual = conversionData.quality
-                    newTotalPixels += newW * newH
-                    newQualSum += newQual
-                    if newQual < newMinQual:
-                        newMinQual = newQual
-
-                    # check if we managed to reduce
-                    if newtex is handler.texture:
-                        if verbose:
-                            print(f"    Can't reduce, skipping.")
-                    else:
                         if verbose:
                             print(
-                                f"    Reduced from {ogW}x{ogH} to {newW}x{newH} while keeping {newQual*100.0:.2f}% quality"
+                                f"    {tierPrefix}Reduced from {ogW}x{ogH} to {newW}x{newH} while keeping {newQual*100.0:.2f}% quality"
                             )
-                        modifiedImageCount += 1
+                        tier.modifiedImageCount += 1
 
-                        # create the directory structure if it doesn't exist
-                        os.makedirs(os.path.dirname(outpath), exist_ok=True)
                         if verbose:
-                            print(f"    Saving to `{outpath}`")
-                        handler.saveReplacement(newtex, outpath)
+                            print(f"    {tierPrefix}Saving to `{outpath}`")
+                        outpathTiers[outpath] = tier
+                        if tier.outputArchive is not None:
+                            memberName = f.filepath.replace(os.sep, "/")
+                            compressType = memberCompressType(
+                                memberName,
+                                (
+                                    f.archive.getinfo(f.filepath)
+                                    if f.archive is not None
+                                    else None
+                                ),
+                            )
+                            writer.submit(
+                                outpath,
+                                functools.partial(
+                                    saveToArchive,
+                                    tier,
+                                    handler,
+                                    newtex,
+                                    memberName,
+                                    compressType,
+                                ),
+                            )
+                        else:
+                            # create the directory structure if it doesn't exist
+                            os.makedirs(os.path.dirname(outpath), exist_ok=True)
+                            writer.submit(
+                                outpath,
+                                functools.partial(
+                                    handler.saveReplacement,
+                                    newtex,
+                                    outpath,
+                                    encoderPool,
+                                    encodingProfile,
+                                ),
+                            )
                 except Exception as e:
                     print(
                         f"Error processing {f.filepath}: {e}",
                         file=sys.stderr,
                     )
                     continue
+                finally:
+                    if timeBudget is not None:
+                        rounds, pixels, _ = fileWork[id(f)]
+                        timeBudget.record(rounds, pixels, time.time() - fileStartTime)
+                        if timeBudget.rankingChanged():
+                            pendingFiles.sort(key=filePayoff)
+
+            # wait for the background saves, they may still queue DDS encoding
+            writeFailures = writer.wait()
+            writer.close()
+            if len(writeFailures):
+                print(f"Failed to save {len(writeFailures)} files:", file=sys.stderr)
+                for failure in writeFailures:
+                    print(f"    {failure.path}: {failure.message}", file=sys.stderr)
+                    outpathTiers[failure.path].modifiedImageCount -= 1
+
+            # wait for the DDS encoders
+            if encoderPool is not None:
+                if verbose:
+                    print("Waiting for DDS encoding to finish...")
+                encodeFailures = encoderPool.wait()
+                encoderPool.close()
+                if len(encodeFailures):
+                    print(
+                        f"Failed to encode {len(encodeFailures)} DDS files:",
+                        file=sys.stderr,
+                    )
+                    for failure in encodeFailures:
+                        print(f"    {failure.path}: {failure.message}", file=sys.stderr)
+                        outpathTiers[failure.path].modifiedImageCount -= 1
+
+            # copy through everything we didn't replace from the input archives
+            for tier in tiers:
+                if tier.outputArchive is not None:
+                    for archive in inputArchives:
+                        for info in archive.infolist():
+                            if info.filename not in tier.writtenMembers:
+                                copyMemberRaw(archive, info, tier.outputArchive)
+                                tier.writtenMembers.add(info.filename)
+                    tier.outputArchive.close()
+
+            # report what didn't fit into the time budget
+            if timeBudget is not None and timeBudget.remaining() < 0.0:
+                print(
+                    f"The run went {-timeBudget.remaining():.2f} seconds over the time budget"
+                )
+            if len(skippedFiles):
+                print(
+                    f"Time budget used up, skipped {len(skippedFiles)}/{len(filenameList)} image files:"
+                )
+                for skipped in skippedFiles:
+                    print(f"    {skipped}")
+
+            if handledImageCount == 0:
+                print("No images were handled!")
+                return
 
             # stats
-            newAvgQual = newQualSum / len(filenameList)
-            print(
-                f"Total memory reduced by {(1.0 - newTotalPixels/ogTotalPixels)*100.0:.2f}%"
-            )
-            print(f"Modified {modifiedImageCount} image files")
-            print(f"On average keeping {newAvgQual*100.0:.2f}% quality")
-            print(f"Minimum accepted quality was {newMinQual*100.0:.2f}%")
-            print(
-                f"Our win ratio is {newAvgQual/(newTotalPixels/ogTotalPixels):.2f}/1.0!"
-            )
-            print("")
+            for tier in tiers:
+                if len(tiers) > 1:
+                    print(f"Reducing by {tier.reduceBy*100.0:g}%:")
+                newAvgQual = tier.newQualSum / handledImageCount
+                print(
+                    f"Total memory reduced by {(1.0 - tier.newTotalPixels/ogTotalPixels)*100.0:.2f}%"
+                )
+                print(f"Modified {tier.modifiedImageCount} image files")
+                print(f"On average keeping {newAvgQual*100.0:.2f}% quality")
+                print(f"Minimum accepted quality was {tier.newMinQual*100.0:.2f}%")
+                print(
+                    f"Our win ratio is {newAvgQual/(tier.newTotalPixels/ogTotalPixels):.2f}/1.0!"
+                )
+                print("")
             print("Enjoy your crisp potato graphics!")
         else:
             print("No files supplied!")
@@ -0,0 +1,102 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import threading
+import time
+
+from .encoderPool import EncodeFailure
+
+# Pillow save options for each output encoding profile, by image format.
+# They only change how hard the encoder tries, never the image quality.
+# Formats that aren't listed are saved with Pillow's defaults.
+encodingProfiles: dict[str, dict[str, dict]] = {
+    "fast": {
+        "PNG": {"compress_level": 1},
+        "WEBP": {"method": 0},
+    },
+    # Pillow's defaults
+    "balanced": {},
+    "smallest": {
+        "PNG": {"compress_level": 9, "optimize": True},
+        "WEBP": {"method": 6},
+        "JPEG": {"optimize": True},
+    },
+}
+
+
+def saveOptions(profile: str, imageFormat: str) -> dict:
+    """
+    Returns the options to pass to Image.save for this profile and image format.
+    """
+    assert profile in encodingProfiles, f"Unknown encoding profile '{profile}'"
+    return encodingProfiles[profile].get(imageFormat.upper(), {})
+
+
+class BackgroundWriter:
+    """
+    Runs save jobs on background threads so reducing the next texture
+    doesn't wait for encoding.
+    At most maxPending jobs are queued, so finished textures
+    don't pile up in memory when saving is the slower part.
+    """
+
+    def __init__(self, maxThreads: int = 1, maxPending: int = 8):
+        self.maxThreads = maxThreads
+        self._executor = ThreadPoolExecutor(max_workers=maxThreads)
+        self._slots = threading.Semaphore(max(maxPending, maxThreads))
+        self._futures: list[Future] = []
+        self._failures: list[EncodeFailure] = []
+        self._lock = threading.Lock()
+        self._pendingCount = 0
+        self._doneCount = 0
+        self._doneSeconds = 0.0
+
+    def submit(self, path: str, save: Callable[[], None]):
+        """
+        Queues save to be run in the background.
+        Blocks while too many jobs are pending.
+        """
+        self._slots.acquire()
+        with self._lock:
+            self._pendingCount += 1
+        self._futures.append(self._executor.submit(self._run, path, save))
+
+    def _run(self, path: str, save: Callable[[], None]):
+        startTime = time.time()
+        try:
+            save()
+        except Exception as e:
+            with self._lock:
+                self._failures.append(EncodeFailure(path, str(e)))
+        finally:
+            with self._lock:
+                self._pendingCount -= 1
+                self._doneCount += 1
+                self._doneSeconds += time.time() - startTime
+            self._slots.release()
+
+    def estimateDrainSeconds(self) -> float:
+        """
+        Estimates how long the queued jobs take to finish,
+        from the time the finished jobs took.
+        """
+        with self._lock:
+            if self._doneCount == 0:
+                return 0.0
+            jobSeconds = self._doneSeconds / self._doneCount
+            return self._pendingCount * jobSeconds / self.maxThreads
+
+    def wait(self) -> list[EncodeFailure]:
+        """
+        Waits for all queued jobs to finish.
+
+        Returns:
+            The failures of all jobs so far, one per output file.
+        """
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+        return list(self._failures)
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
@@ -20,6 +20,14 @@ class Texture:
         self.image = image
         self._embedding: np.ndarray | None = None
 
+    @property
+    def width(self) -> int:
+        return self.image.width
+
+    @property
+    def height(self) -> int:
+        return self.image.height
+
     def getEmbedding(self) -> np.ndarray:
         """
         Retrieve the embedding for the image.
@@ -31,6 +39,19 @@ class Texture:
             self._embedding = np.asarray(ibed.to_embeddings(self.image)).flatten()
         return self._embedding
 
+    @staticmethod
+    def embeddingsMany(textures: list["Texture"]) -> list[np.ndarray]:
+        """
+        Retrieve the embeddings for several textures,
+        the missing ones are generated in a single batch.
+        """
+        missing = list({id(t): t for t in textures if t._embedding is None}.values())
+        if len(missing):
+            embeddings = np.asarray(ibed.to_embeddings([t.image for t in missing]))
+            for t, embedding in zip(missing, embeddings):
+                t._embedding = embedding.flatten()
+        return [t._embedding for t in textures]
+
     def similarityTo(self, other: "Texture") -> float:
         """
         Calculate the similarity between this texture and another texture.
@@ -42,17 +63,12 @@ class Texture:
             float: The similarity score between the two textures.
         """
 
-        def rescale(a):
-            if a >= 0.9999999:
-                a = 0.9999999
-            elif a <= -0.9999999:
-                a = -0.9999999
-            return 1.0 - math.sin(math.acos(a))
-
-        return rescale(
-            vecDiff(
-                self.getEmbedding(),
-                other.getEmbedding(),
+        return float(
+            rescaleSimilarity(
+                vecDiff(
+                    self.getEmbedding(),
+                    other.getEmbedding(),
+                )
             )
         )
 
@@ -107,3 +123,12 @@ class Texture:
             return other
         else:
             return Texture(im.blend(self.image, other.image, alpha))
+
+    def transformFadedToMany(
+        self, other: "Texture", alphas: list[float]
+    ) -> list["Texture"]:
+        """
+        Returns copies of this texture blended with the other, one for each alpha.
+        Identity transformations return itself or the other.
+        """
+        return [self.transformFadedTo(other, a) for a in alphas]